@@ -10,8 +10,7 @@ __author_email__ = 'adrian.sw.tam@gmail.com'
 from .feeds import add_feed_data_ver, get_feed_data, is_feed, is_base_feed, \
         list_feed_data_vers, list_feed_subfeeds, list_feed_vers, list_feeds
 from .utils import exception_hook, print_tb_with_local, supports_color, \
-        get_logger, readxml, readkeyval, readyaml, email, curl, sieve, flatten, \
-        subdict
+        get_logger, readxml, readkeyval, readyaml, email, curl, sieve, subdict
 from .iters import take, prepend, tabulate, tail, consume, nth, all_equal, \
         quantify, padnone, ncycles, dotproduct, flatten, repeatfunc, pairwise, \
         grouper, roundrobin, partition, powerset, unique_everseen, \
@@ -23,7 +22,7 @@ from .unicode import unicoderemove, unicodereplace, \
         letters_only, digits_only, letters_tokens
 from .excel import pixel2colwidth, str2pixels
 try:
-    from .web.browser import browser
+    from .web.browser import browser, BrowserPool
 except ImportError:
     pass  # ignore if no selenium
 
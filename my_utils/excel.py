@@ -6,52 +6,118 @@ Excel formatting related functions
 The measurement data are from https://bitbucket.org/jky/cpytoxlsf.py
 """
 
+import functools
+import math
+
 __all__ = ["pixel2colwidth", "str2pixels"]
 
 # Font measurement data in pixel width: Calibri 11 normal and bold
-CALIBRI = {c: w for s, w in {
-    'W@': 377.01 / 28,
-    'mM': 348.01 / 28,
-    'w%': 319.01 / 28,
-    'NOQ&': 290.01 / 28,
-    'ADGHUV': 261.01 / 28,
-    'bdehnopquBCKPRX': 232.01 / 28,
-    '0123456789agkvxyEFSTYZ#$*+<=>?^_|~': 203.01 / 28,
-    'cszL"/\\': 174.01 / 28,
-    'frtJ!()-[]{}': 145.01 / 28,
-    'ijlI,.:;`': 116.01 / 28,
-    "' ": 87.01 / 28,
-}.items() for c in s}
-CALIBRIBOLD = {c: w for s, w in {
-    'W': 406.01 / 28,
-    'M@': 377.01 / 28,
-    'm': 348.01 / 28,
-    'w%&': 319.01 / 28,
-    'GNOQU': 290.01 / 28,
-    'ADHV': 261.01 / 28,
-    'bdehnopquBCKPRXY': 232.01 / 28,
-    '0123456789agkvxyEFSTZ"#$*+<=>?^_|~': 203.01 / 28,
-    'cszL/\\': 174.01 / 28,
-    'frtJ!()-[]`{}': 145.01 / 28,
-    "ijlI',.:;": 116.01 / 28,
-    ' ': 87.01 / 28,
-}.items() for c in s}
+_CALIBRI_RAW = (
+    ('W@', 377.01 / 28),
+    ('mM', 348.01 / 28),
+    ('w%', 319.01 / 28),
+    ('NOQ&', 290.01 / 28),
+    ('ADGHUV', 261.01 / 28),
+    ('bdehnopquBCKPRX', 232.01 / 28),
+    ('0123456789agkvxyEFSTYZ#$*+<=>?^_|~', 203.01 / 28),
+    ('cszL"/\\', 174.01 / 28),
+    ('frtJ!()-[]{}', 145.01 / 28),
+    ('ijlI,.:;`', 116.01 / 28),
+    ("' ", 87.01 / 28),
+)
+CALIBRI = {c: w for s, w in _CALIBRI_RAW for c in s}
+_CALIBRIBOLD_RAW = (
+    ('W', 406.01 / 28),
+    ('M@', 377.01 / 28),
+    ('m', 348.01 / 28),
+    ('w%&', 319.01 / 28),
+    ('GNOQU', 290.01 / 28),
+    ('ADHV', 261.01 / 28),
+    ('bdehnopquBCKPRXY', 232.01 / 28),
+    ('0123456789agkvxyEFSTZ"#$*+<=>?^_|~', 203.01 / 28),
+    ('cszL/\\', 174.01 / 28),
+    ('frtJ!()-[]`{}', 145.01 / 28),
+    ("ijlI',.:;", 116.01 / 28),
+    (' ', 87.01 / 28),
+)
+CALIBRIBOLD = {c: w for s, w in _CALIBRIBOLD_RAW for c in s}
 # Font measurement data in Arial 10, bold size has a factor of 1.1
-ARIAL = {c: w for s, w in {
-    '@W': 496.356 / 28,
-    'Mm': 379.259 / 28,
-    '%': 438.044 / 28,
-    'CDGOQ': 350.341 / 28,
-    '&ABEHKNPRSUVXYw': 321.422 / 28,
-    '+<=>F~': 291.556 / 28,
-    '#$0123456789?JLTZ_abcdeghnopquy': 262.637 / 28,
-    'ksz': 233.244 / 28,
-    '*^vx': 203.852 / 28,
-    '"()-`r{}': 175.407 / 28,
-    ' !,./:;I[\\]f|': 146.015 / 28,
-    'it': 117.096 / 28,
-    "'jl": 88.178 / 28,
-}.items() for c in s}
+_ARIAL_RAW = (
+    ('@W', 496.356 / 28),
+    ('Mm', 379.259 / 28),
+    ('%', 438.044 / 28),
+    ('CDGOQ', 350.341 / 28),
+    ('&ABEHKNPRSUVXYw', 321.422 / 28),
+    ('+<=>F~', 291.556 / 28),
+    ('#$0123456789?JLTZ_abcdeghnopquy', 262.637 / 28),
+    ('ksz', 233.244 / 28),
+    ('*^vx', 203.852 / 28),
+    ('"()-`r{}', 175.407 / 28),
+    (' !,./:;I[\\]f|', 146.015 / 28),
+    ('it', 117.096 / 28),
+    ("'jl", 88.178 / 28),
+)
+ARIAL = {c: w for s, w in _ARIAL_RAW for c in s}
+
+# Same font measurement data as numpy arrays indexed by code point, NaN for characters not
+# measured. Used to sum widths of long strings in vectorized operation
+_VECTORIZE_MINLEN = 256  # below this length, numpy call overhead outweighs the gain
+
+@functools.lru_cache(maxsize=None)
+def _width_array(raw):
+    """Return a numpy array of character width indexed by code point, or None if numpy is not
+    available. Built on first use such that numpy is imported only for long strings"""
+    try:
+        import numpy as np
+    except ImportError:
+        return None  # measure strings character by character
+    widths = np.full(max(ord(c) for chars, _ in raw for c in chars) + 1, np.nan)
+    for chars, width in raw:
+        widths[[ord(c) for c in chars]] = width
+    return widths
+
+@functools.lru_cache(maxsize=None)
+def _sum_widths_kernel():
+    """Return a numba-compiled function to add the width of each code point to a total, which
+    returns NaN if any code point is out of range. None if numba is not available. Built on
+    first use such that numba is imported only for long strings. The compiled code is cached on
+    disk, in __pycache__ or the directory set by environment variable NUMBA_CACHE_DIR"""
+    try:
+        from numba import njit
+    except ImportError:
+        return None  # sum widths with numpy
+    import numpy as np
+    @njit(cache=True)
+    def _sum_widths(codes, widths, total):
+        for code in codes:
+            if code >= widths.size:
+                return np.nan
+            total += widths[code]
+        return total
+    return _sum_widths
+
+# Same font measurement data as 128-entry lists indexed by ASCII code, NaN for characters not
+# measured. Used for the common case of ASCII strings
+def _ascii_widths(raw):
+    "Return a list of character width indexed by ASCII code"
+    widths = [math.nan] * 128
+    for chars, width in raw:
+        for c in chars:
+            widths[ord(c)] = width
+    return widths
+
+_CALIBRI_ASCII = _ascii_widths(_CALIBRI_RAW)
+_CALIBRIBOLD_ASCII = _ascii_widths(_CALIBRIBOLD_RAW)
+_ARIAL_ASCII = _ascii_widths(_ARIAL_RAW)
+
+# Font name -> (measurement dict, raw measurement data, ASCII list), and scale factor of bold fonts
+_FONTS = {
+    "calibri11": (CALIBRI, _CALIBRI_RAW, _CALIBRI_ASCII),
+    "calibribold11": (CALIBRIBOLD, _CALIBRIBOLD_RAW, _CALIBRIBOLD_ASCII),
+    "arial10": (ARIAL, _ARIAL_RAW, _ARIAL_ASCII),
+    "arialbold10": (ARIAL, _ARIAL_RAW, _ARIAL_ASCII),
+}
+_BOLD_SCALE = {"arialbold10": 1.1}
 
 def pixel2colwidth(pixel_width: float) -> float:
     """Convert text width in pixels into column width. For use in Excel"""
@@ -70,19 +136,35 @@ def str2pixels(s: str, font: str) -> float:
         s: string to measure for width
         font: Any of the following: ["arial10", "arialbold10", "calibri11", "calibribold11"]
     """
-    if font == "calibri11":
-        fontdict = CALIBRI
-    elif font == "calibribold11":
-        fontdict = CALIBRIBOLD
-    elif font in ["arial10", "arialbold10"]:
-        fontdict = ARIAL
-    else:
+    try:
+        fontdict, raw, asciiwidths = _FONTS[font]
+    except KeyError:
         raise NotImplementedError("Unrecognized font string {}".format(font))
-    pixels = 7
-    for c in s:
-        pixels += fontdict[c]
-    if font == "arialbold10":
-        pixels *= 1.1
-    return pixels
+    pixels = None
+    widths = _width_array(raw) if len(s) >= _VECTORIZE_MINLEN else None
+    if widths is not None:
+        import numpy as np
+        codes = np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32)
+        sum_widths = _sum_widths_kernel()
+        if sum_widths is not None:
+            total = sum_widths(codes, widths, 7.0)
+            if not math.isnan(total):
+                pixels = total
+        elif codes.max() < len(widths):
+            total = widths[codes].sum()
+            if not np.isnan(total):
+                pixels = 7 + float(total)
+    if pixels is None and s.isascii():
+        total = 7
+        for code in s.encode("ascii"):
+            total += asciiwidths[code]
+        if not math.isnan(total):
+            pixels = total
+    if pixels is None:
+        # some character not measured: a KeyError is raised
+        pixels = 7
+        for c in s:
+            pixels += fontdict[c]
+    return pixels * _BOLD_SCALE.get(font, 1.0)
 
 # vim:set ts=4 sw=4 sts=4 tw=100 fdm=indent et:
@@ -34,16 +34,23 @@ content should therefore skipped to avoid accessing partial data.
 This module provides the CRUD operations down to the feed data version level.
 """
 
+import concurrent.futures
 import datetime
+import functools
 import os
+import re
 import shutil
-from pipe import where, select, sort, reverse, as_list
+import stat
+import time
 
 __all__ = [
     "list_feeds", "is_feed", "is_base_feed", "list_feed_vers", "list_feed_data_vers",
     "list_feed_subfeeds", "get_feed_data", "add_feed_data_ver"
 ]
 
+# match a feed version: 4-digit string
+_match_feed_ver = re.compile(r"[0-9]{4}\Z").match
+
 def list_feeds(feedroot):
     """List out names of all feeds
 
@@ -52,13 +59,82 @@ def list_feeds(feedroot):
 
     Returns:
         list of strings, each is a valid feed name
+
+    The is_feed() check of each entry is cached. A feed is remembered with the
+    data version file found in it and stays a feed while that file exists. A
+    non-feed is remembered with the mtime of every directory scanned and is
+    checked again once any of them is modified
     """
     assert os.path.isdir(feedroot)
-    names = ( os.listdir(feedroot)
-            | where(lambda name: is_feed(os.path.join(feedroot, name)))
-            | sort
-            | as_list )
-    return names
+    names, misses = [], []
+    with os.scandir(feedroot) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            cached = _feed_cache.get(entry.path)
+            if cached is None or not _feed_cache_valid(*cached):
+                misses.append((entry.name, entry.path))
+            elif cached[0]:
+                names.append(entry.name)
+    # checks are independent and bound by filesystem metadata I/O, run them concurrently only if
+    # there are enough of them to pay for starting the threads
+    paths = [path for _, path in misses]
+    if len(misses) >= _CONCURRENT_MINMISSES:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(_scan_feed, paths))
+    else:
+        results = [_scan_feed(path) for path in paths]
+    if len(_feed_cache) + len(misses) > _FEED_CACHE_MAXSIZE:
+        _feed_cache.clear()
+    for (name, path), (found, scanned) in zip(misses, results):
+        if found or scanned is not None:
+            _feed_cache[path] = (found, scanned)
+        if found:
+            names.append(name)
+    return sorted(names)
+
+# is_feed() results memoized on the directory path, as path -> (data version file found or None,
+# list of (directory, mtime in nanoseconds) scanned to find nothing)
+_feed_cache = {}
+_FEED_CACHE_MAXSIZE = 4096
+_CONCURRENT_MINMISSES = 256 # below this number of cache misses, checks run in the calling thread
+_MTIME_SLACK_NS = 2 * 10**9 # mtime granularity of some filesystems is as coarse as 2 seconds
+
+def _scan_feed(dirpath):
+    """is_feed() for the cache: Return the path of a data version file in the
+    feed, and the list of (directory, mtime) scanned if none is found, or None
+    in place of the list if the result is not to be cached as some directory is
+    modified too recently for the mtime to tell further changes
+    """
+    scanned = []
+    found = _find_data_ver(dirpath, scanned)
+    if found:
+        return found, None
+    recent = time.time_ns() - _MTIME_SLACK_NS
+    if any(mtime_ns >= recent for _, mtime_ns in scanned):
+        return None, None
+    return None, scanned
+
+def _feed_cache_valid(found, scanned):
+    """Tell if a _feed_cache entry still holds, by checking the data version
+    file found still exists or none of the scanned directories is modified"""
+    if found:
+        return _is_data_ver(found)
+    for dirpath, mtime_ns in scanned:
+        try:
+            if os.stat(dirpath).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+def _is_data_ver(path):
+    """Tell if path exists and is not a directory, as the all-digit files that
+    _iter_data_vers() looks for"""
+    try:
+        return not stat.S_ISDIR(os.stat(path).st_mode)
+    except OSError:
+        return os.path.lexists(path) # broken symlinks are not directories
 
 def is_base_feed(dirpath):
     """Check if a directory is a feed directory. It is affirmative if and only
@@ -75,32 +151,73 @@ def is_base_feed(dirpath):
     """
     if not os.path.isdir(dirpath):
         return False # not a directory
-    ver_dir = ( os.listdir(dirpath)
-              | where(lambda name: len(name)==4 and name.isdigit()) # 4-digit
-              | select(lambda name: os.path.join(dirpath, name))
-              | where(os.path.isdir) # feed ver is a dir
-              | select(lambda path: os.path.join(path, 'versions'))
-              | where(os.path.isdir) # data ver is a dir
-              | where(lambda path: any(name.isdigit() for name in os.listdir(path))) # all-digit
-              | as_list ) # list of "feed_name/0001/versions"
-    return False if not ver_dir else True
+    with os.scandir(dirpath) as it:
+        return any(_match_feed_ver(entry.name) and entry.is_dir()
+                   and _has_numeric_entry(os.path.join(entry.path, 'versions'))
+                   for entry in it)
+
+def _has_numeric_entry(dirpath):
+    """Check if dirpath is a directory containing some all-numeric files or
+    directories. Stop at the first one found
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            return any(entry.name.isdigit() for entry in it)
+    except (FileNotFoundError, NotADirectoryError):
+        return False # data ver is a dir
+
+def _iter_data_vers(dirpath, isversions=False, scanned=None):
+    """Recursively generate the path of each all-digit file under a directory
+    named `versions` beneath dirpath. Meant to be consumed by any() or next()
+    such that the scan stops at the first match. Unreadable directories are
+    skipped, as os.walk() does. If scanned is a list, (path, mtime) of each
+    directory is appended to it before the directory is scanned
+    """
+    try:
+        if scanned is not None:
+            scanned.append((dirpath, os.stat(dirpath).st_mtime_ns))
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        return
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.is_symlink():
+                subdirs.append(entry) # os.walk() does not follow symlinks
+        elif isversions and entry.name.isdigit():
+            yield entry.path # all-digit files
+    for entry in subdirs:
+        yield from _iter_data_vers(entry.path, entry.name == 'versions', scanned)
+
+def _find_data_ver(dirpath, scanned=None):
+    """Return the path of the first data version file found in the feed at
+    dirpath, or None if dirpath is not a feed. If scanned is a list, (path,
+    mtime) of each directory is appended to it before the directory is scanned
+    """
+    try:
+        st = os.stat(dirpath)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None # not a directory
+    if scanned is not None:
+        scanned.append((dirpath, st.st_mtime_ns))
+    try:
+        with os.scandir(dirpath) as it:
+            feed_vers = [entry.path for entry in it
+                         if _match_feed_ver(entry.name) and entry.is_dir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return None # removed after stat
+    for path in feed_vers:
+        for found in _iter_data_vers(path, scanned=scanned):
+            return found
+    return None
 
 def is_feed(dirpath):
     """Similar to is_base_feed(), but also cover feeds with subfeeds
     """
-    if not os.path.isdir(dirpath):
-        return False # not a directory
-    ver_dir = ( os.listdir(dirpath)
-              | where(lambda name: len(name)==4 and name.isdigit()) # 4-digit
-              | select(lambda name: os.path.join(dirpath, name))
-              | where(os.path.isdir) # feed ver is a dir
-              | as_list ) # list of "feed_name/0001/versions"
-    for dirname in ver_dir:
-        for root, _dirs, files in os.walk(dirname):
-            if root.rsplit(os.sep, 1)[-1] == 'versions' and \
-               any(name.isdigit() for name in files): # all-digit files
-                return True
-    return False
+    return _find_data_ver(dirpath) is not None
 
 def list_feed_vers(feedroot, feedname):
     """Assume the feed directory exists. Return the list of feed versions in
@@ -114,13 +231,10 @@ def list_feed_vers(feedroot, feedname):
         list of strings, each is a valid feed version
     """
     dirpath = os.path.join(feedroot, feedname)
-    vers = ( os.listdir(dirpath)
-           | where(lambda name: len(name)==4 and name.isdigit())
-           | where(lambda path: os.path.isdir(os.path.join(dirpath, path)))
-           | sort
-           | reverse
-           | as_list )
-    return vers
+    with os.scandir(dirpath) as it:
+        vers = [entry.name for entry in it
+                if _match_feed_ver(entry.name) and entry.is_dir()]
+    return sorted(vers, reverse=True)
 
 def list_feed_subfeeds(feedroot, feedname, feedver, subfeednames=()):
     """Assume the feed data directory exists. Return the list of subfeed names
@@ -140,14 +254,27 @@ def list_feed_subfeeds(feedroot, feedname, feedver, subfeednames=()):
     dirpath = os.path.join(feeddir, *subfeednames)
     if not os.path.isdir(dirpath):
         return [] # not a directory or not exists
-    subfeeds = ( os.walk(dirpath)
-               | where(lambda rootdirfile: "versions" in rootdirfile[1])
-               | select(lambda rootdirfile: rootdirfile[0][len(feeddir):])
-               | sort
-               | select(lambda dirname: list(filter(None, dirname.split(os.sep))))
-               | where(lambda dirparts: "versions" not in dirparts)
-               | as_list )
-    return subfeeds
+    subfeeds = []
+    _find_versions_parents(dirpath, feeddir, subfeeds)
+    subfeeds = [list(filter(None, dirname.split(os.sep))) for dirname in sorted(subfeeds)]
+    return [dirparts for dirparts in subfeeds if "versions" not in dirparts]
+
+def _find_versions_parents(dirpath, feeddir, out):
+    """Recursively find dirpath and directories beneath it that has a `versions`
+    subdirectory and append their path relative to feeddir to the list `out`.
+    The `versions` subtrees are not scanned, nor symlinked directories, as in
+    os.walk()
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            subdirs = [entry for entry in it if entry.is_dir()]
+    except OSError:
+        return
+    if any(entry.name == "versions" for entry in subdirs):
+        out.append(dirpath[len(feeddir):])
+    for entry in subdirs:
+        if entry.name != "versions" and not entry.is_symlink():
+            _find_versions_parents(entry.path, feeddir, out)
 
 def list_feed_data_vers(feedroot, feedname, feedver, subfeednames=None):
     """Assume the feed data directory exists. Return the list of data versions
@@ -169,14 +296,12 @@ def list_feed_data_vers(feedroot, feedname, feedver, subfeednames=None):
         dirpath = os.path.join(*dirpath)
     else:
         dirpath = os.path.join(feedroot, feedname, feedver, 'versions')
-    if not os.path.isdir(dirpath):
+    try:
+        with os.scandir(dirpath) as it:
+            vers = [entry.name for entry in it if entry.name.isdigit()]
+    except (FileNotFoundError, NotADirectoryError):
         return [] # not a directory or not exists
-    vers = ( os.listdir(dirpath)
-           | where(lambda name: name.isdigit())
-           | sort
-           | reverse
-           | as_list )
-    return vers
+    return sorted(vers, reverse=True)
 
 def get_feed_data(feedroot, feedname, feedver, dataver, subfeednames=None, subpath=None):
     """Read a particular feed data version
@@ -204,6 +329,48 @@ def get_feed_data(feedroot, feedname, feedver, dataver, subfeednames=None, subpa
         dirpath.append(subpath)
     return open(os.path.join(*dirpath))
 
+@functools.lru_cache(maxsize=1024)
+def _makedirs(dirpath):
+    """os.makedirs() memoized such that a directory is created, or checked for
+    existence, only once per process. Directories removed afterwards are not
+    recreated by this function: callers shall catch FileNotFoundError,
+    _makedirs.cache_clear() and retry
+    """
+    os.makedirs(dirpath, exist_ok=True)
+
+def _copyfile(src, dst):
+    """Copy content of file src to dst. Use os.copy_file_range() where available
+    such that the data is copied in kernel (or reflinked on filesystems such as
+    Btrfs and XFS), otherwise fallback to shutil.copyfile(), which uses
+    os.sendfile() on Linux
+
+    Returns:
+        dst
+    """
+    if hasattr(os, "copy_file_range"):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            infd, outfd = fsrc.fileno(), fdst.fileno()
+            blocksize = min(max(os.fstat(infd).st_size, 2**23), 2**30)
+            copied = 0
+            try:
+                while True:
+                    sent = os.copy_file_range(infd, outfd, blocksize)
+                    if not sent:
+                        return dst
+                    copied += sent
+            except OSError:
+                if copied:
+                    raise # failed halfway, cannot fallback
+    return shutil.copyfile(src, dst)
+
+def _copy2(src, dst):
+    """Same as shutil.copy2() but copy the file content with _copyfile()"""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    _copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
 def add_feed_data_ver(filename, feedroot, feedname, feedver, subfeednames=None, dataver=None, move=False):
     """Push in a file into a feed directory. It will create appropriate
     directories if not exists and move the `filename` into there and named as
@@ -223,7 +390,9 @@ def add_feed_data_ver(filename, feedroot, feedname, feedver, subfeednames=None,
         str of the version
     """
     if not dataver:
-        dataver = datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        now = datetime.datetime.now(datetime.timezone.utc)
+        dataver = "{:04d}{:02d}{:02d}{:02d}{:02d}{:02d}".format(
+            now.year, now.month, now.day, now.hour, now.minute, now.second)
     assert isinstance(dataver, str) and dataver.isdigit()
 
     # prepare destination
@@ -234,21 +403,33 @@ def add_feed_data_ver(filename, feedroot, feedname, feedver, subfeednames=None,
         dirpath = os.path.join(*dirpath)
     else:
         dirpath = os.path.join(feedroot, feedname, feedver, 'versions')
-    os.makedirs(dirpath, exist_ok=True)
-    isdir = os.path.isdir(filename)
-    assert isdir or os.path.isfile(filename)
+    _makedirs(dirpath)
+    try:
+        mode = os.stat(filename).st_mode # one stat for both isdir and isfile
+    except OSError:
+        mode = 0
+    isdir = stat.S_ISDIR(mode)
+    assert isdir or stat.S_ISREG(mode)
     tempdest = os.path.join(dirpath, "."+dataver)
     permdest = os.path.join(dirpath, dataver)
     assert not os.path.exists(tempdest) # also asserts tempdest!=filename
     assert not os.path.exists(permdest)
 
-    # copy or move
-    if move: # move dir/file
-        shutil.move(filename, tempdest)
-    elif isdir: # copy dir recursively
-        shutil.copytree(filename, tempdest)
-    else: # copy single file
-        shutil.copyfile(filename, tempdest)
+    # copy or move, retry once if dirpath is removed since _makedirs() remembered it
+    for retry in (True, False):
+        try:
+            if move: # move dir/file
+                shutil.move(filename, tempdest)
+            elif isdir: # copy dir recursively
+                shutil.copytree(filename, tempdest, copy_function=_copy2)
+            else: # copy single file
+                _copyfile(filename, tempdest)
+            break
+        except FileNotFoundError:
+            if not retry or os.path.isdir(dirpath):
+                raise
+            _makedirs.cache_clear()
+            _makedirs(dirpath)
     shutil.move(tempdest, permdest)
     return dataver
 
@@ -4,8 +4,28 @@
 Unicode and string related functions
 """
 
+import functools
+import sys
 import unicodedata
 
+# unicodedata.category() memoized, categories are fixed for a character
+_category = functools.lru_cache(maxsize=None)(unicodedata.category)
+
+class _CategoryTable(dict):
+    """Translation table for str.translate() to keep characters that passed the
+    category check and replace the others. Entries are filled on first lookup of
+    each code point such that the translation loop runs in C for characters seen
+    before
+    """
+    def __init__(self, category_check, replacer=None):
+        super().__init__()
+        self.category_check = category_check
+        self.replacer = replacer # None to remove
+    def __missing__(self, codepoint):
+        keep = self.category_check(_category(chr(codepoint)))
+        value = self[codepoint] = codepoint if keep else self.replacer
+        return value
+
 def unicoderemove(s, category_check):
     '''
     Remove characters of certain categories from the unicode string
@@ -19,9 +39,10 @@ def unicoderemove(s, category_check):
         The unicode string of input transformed into normal form KD (compatibility
         decomposition) with characters of the specified categories removed
     '''
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
     assert isinstance(s, str)
-    return "".join(c for c in unicodedata.normalize('NFKD', s)
-                   if category_check(unicodedata.category(c)))
+    return unicodedata.normalize('NFKD', s).translate(_CategoryTable(category_check))
 
 def unicodereplace(s, replacer, category_check):
     '''
@@ -29,7 +50,7 @@ def unicodereplace(s, replacer, category_check):
 
     Args:
         s (str): input string, assumed in utf8 encoding if it is a bytestring
-        r (str): replacement string
+        replacer (str): replacement string
         category_check (callable): a function that takes output of
                 unicodedata.category() and returns if such character should be kept in the output
     Returns:
@@ -37,19 +58,50 @@ def unicodereplace(s, replacer, category_check):
         decomposition) with each characters of the specified categories replaced by
         the replacement string
     '''
+    if isinstance(s, bytes):
+        s = s.decode('utf-8')
     assert isinstance(s, str)
-    return "".join(c if category_check(unicodedata.category(c)) else replacer
-                   for c in unicodedata.normalize('NFKD', s))
+    return unicodedata.normalize('NFKD', s).translate(_CategoryTable(category_check, replacer))
+
+# Category names are from http://www.fileformat.info/info/unicode/category/index.htm
+_PUNCTUATIONS = frozenset(['Pc','Pd','Pe','Pf','Pi','Po','Ps'])
+_LETTERS = frozenset(['Ll','Lm','Lo','Lt','Lu'])
+
+@functools.lru_cache(maxsize=None)
+def _codepoints(categories):
+    """Return the frozenset of all code points belonging to any of the frozenset
+    of categories. Built on first use as it scans the whole code space"""
+    return frozenset(i for i in range(sys.maxunicode + 1)
+                     if unicodedata.category(chr(i)) in categories)
 
-# Remove characters of nonspacing mark (Mn) category
-deaccent = lambda s: unicoderemove(s, lambda c: c != 'Mn').replace('\u02b9', '')
+@functools.lru_cache(maxsize=None)
+def _deaccent_table():
+    "Translation table to remove nonspacing marks (Mn) and modifier letter prime (U+02B9)"
+    table = dict.fromkeys(_codepoints(frozenset(['Mn'])))
+    table[0x02b9] = None
+    return table
 
-# Remove punctuations, category names are from http://www.fileformat.info/info/unicode/category/index.htm
-depunctuation = lambda s: unicodereplace(s, ' ', lambda c: c not in ['Pc','Pd','Pe','Pf','Pi','Po','Ps'])
+@functools.lru_cache(maxsize=None)
+def _depunctuation_table():
+    "Translation table to replace punctuations with space"
+    return dict.fromkeys(_codepoints(_PUNCTUATIONS), ' ')
+
+def deaccent(s):
+    "Remove characters of nonspacing mark (Mn) category, with the input transformed into normal form KD"
+    assert isinstance(s, str)
+    return unicodedata.normalize('NFKD', s).translate(_deaccent_table())
+
+def depunctuation(s):
+    "Replace punctuations with space, with the input transformed into normal form KD"
+    assert isinstance(s, str)
+    return unicodedata.normalize('NFKD', s).translate(_depunctuation_table())
 
 # Keep only letters, all CJK ideographs are defined as other letters (Lo)
-letters_only = lambda s: unicoderemove(s, lambda c: c in ['Ll','Lm','Lo','Lt','Lu'])
-digits_only = lambda s: unicoderemove(s, lambda c: c == 'Nd')
-letters_tokens = lambda s: unicodereplace(s, ' ', lambda c: c in ['Ll','Lm','Lo','Lt','Lu'])
+_LETTERS_ONLY = _CategoryTable(lambda c: c in _LETTERS)
+_DIGITS_ONLY = _CategoryTable(lambda c: c == 'Nd')
+_LETTERS_TOKENS = _CategoryTable(lambda c: c in _LETTERS, ' ')
+letters_only = lambda s: unicodedata.normalize('NFKD', s).translate(_LETTERS_ONLY)
+digits_only = lambda s: unicodedata.normalize('NFKD', s).translate(_DIGITS_ONLY)
+letters_tokens = lambda s: unicodedata.normalize('NFKD', s).translate(_LETTERS_TOKENS)
 
 # vim:set ts=4 sw=4 sts=4 tw=100 fdm=indent et:
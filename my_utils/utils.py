@@ -4,11 +4,13 @@
 Application-agnostic utility functions
 """
 
+import functools
 import io
 import logging
 import mimetypes
 import os
 import os.path
+import re
 import smtplib
 import sys
 
@@ -55,7 +57,7 @@ def print_tb_with_local():
     stack = []
     while tb:
         stack.append(tb.tb_frame)
-        tb = tb.tb_next()
+        tb = tb.tb_next
     traceback.print_exc()
     print("Locals by frame, innermost last", file=sys.stderr)
     for frame in stack:
@@ -66,13 +68,8 @@ def print_tb_with_local():
         for key, value in frame.f_locals.items():
             print("\t%20s = " % key, file=sys.stderr)
             try:
-                if '__repr__' in dir(value):
-                    print(value.__repr__(), file=sys.stderr)
-                elif '__str__' in dir(value):
-                    print(value.__str__(), file=sys.stderr)
-                else:
-                    print(value, file=sys.stderr)
-            except:
+                print(repr(value), file=sys.stderr)
+            except Exception:
                 print("<CANNOT PRINT VALUE>", file=sys.stderr)
 
 def supports_color():
@@ -101,6 +98,37 @@ ANSI_COLOR = "\033[1;%dm"
 ANSI_BOLD = "\033[1m"
 (BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE) = range(30, 38)
 
+# log line format for both console and file
+LOGFORMAT = "%(asctime)s|%(name)s(%(filename)s:%(lineno)d)|%(levelname)s|%(message)s"
+
+@functools.lru_cache(maxsize=1)
+def _supports_color_cached():
+    """supports_color() evaluated once per process"""
+    return supports_color()
+
+class ColouredFormatter(logging.Formatter):
+    "log message formatter to color messages according to levels"
+    colours = {"DEBUG":BLUE, "INFO":CYAN, "WARNING":YELLOW, "ERROR":RED, "CRITICAL":MAGENTA}
+    def format(self, record):
+        msg = logging.Formatter.format(self, record)
+        if record.levelname in self.colours:
+            msg = (ANSI_COLOR % self.colours[record.levelname]) + msg + ANSI_RESET
+        return msg
+
+# logging level string prefixes, none of them is a prefix of another
+_LOGLEVEL_PREFIXES = {
+    "all":   logging.NOTSET,
+    "not":   logging.NOTSET,
+    "debug": logging.DEBUG,
+    "info":  logging.INFO,
+    "warn":  logging.WARN,
+    "err":   logging.ERROR,
+    "except":logging.ERROR,
+    "crit":  logging.CRITICAL,
+    "fatal": logging.FATAL,
+}
+_LOGLEVEL_PREFIXLENS = sorted({len(prefix) for prefix in _LOGLEVEL_PREFIXES}, reverse=True)
+
 def _loglevelcode(levelstring):
     """Convert a logging level string into the integer code.
     Python 3.2+ supports level strings but this way is more flexible
@@ -111,19 +139,10 @@ def _loglevelcode(levelstring):
     Returns:
         int of the corresponding logging level according to the logging module
     """
-    levelmap = {
-        "all":   logging.NOTSET,
-        "not":   logging.NOTSET,
-        "debug": logging.DEBUG,
-        "info":  logging.INFO,
-        "warn":  logging.WARN,
-        "err":   logging.ERROR,
-        "except":logging.ERROR,
-        "crit":  logging.CRITICAL,
-        "fatal": logging.FATAL,
-    }
-    for prefix, levelcode in levelmap.items():
-        if levelstring.lower().startswith(prefix):
+    levelstring = levelstring.lower()
+    for n in _LOGLEVEL_PREFIXLENS:
+        levelcode = _LOGLEVEL_PREFIXES.get(levelstring[:n])
+        if levelcode is not None:
             return levelcode
     return None # not recognized
 
@@ -166,42 +185,68 @@ def get_logger(root=None, level=logging.DEBUG, filename=None, filelevel=None,
     if reset and logger.handlers:
         logger.handlers = [] # empty existing handlers
     # console handler
-    consoleformat = "%(asctime)s|%(name)s(%(filename)s:%(lineno)d)|%(levelname)s|%(message)s"
     if not console:
         logger.addHandler(logging.NullHandler())
     else:
         shandler = logging.StreamHandler()
         shandler.setLevel(level)
-        if not supports_color():
-            shandler.setFormatter(logging.Formatter(consoleformat))
+        if not _supports_color_cached():
+            shandler.setFormatter(logging.Formatter(LOGFORMAT))
         else:
-            colours = {"DEBUG":BLUE, "INFO":CYAN, "WARNING":YELLOW, "ERROR":RED, "CRITICAL":MAGENTA}
-            class ColouredFormatter(logging.Formatter):
-                "log message formatter to color messages according to levels"
-                def format(self, record):
-                    msg = logging.Formatter.format(self, record)
-                    if record.levelname in colours:
-                        msg = (ANSI_COLOR % colours[record.levelname]) + msg + ANSI_RESET
-                    return msg
-            shandler.setFormatter(ColouredFormatter(consoleformat))
+            shandler.setFormatter(ColouredFormatter(LOGFORMAT))
         logger.addHandler(shandler)
     # file handler
-    fileformat = "%(asctime)s|%(name)s(%(filename)s:%(lineno)d)|%(levelname)s|%(message)s"
     filetimeformat = "%Y-%m-%d %H.%M.%S"
     if filename:
         fhandler = logging.FileHandler(filename, encoding="utf8")
         fhandler.setLevel(filelevel)
-        fhandler.setFormatter(logging.Formatter(fileformat, filetimeformat))
+        fhandler.setFormatter(logging.Formatter(LOGFORMAT, filetimeformat))
         logger.addHandler(fhandler)
     if stream:
         shandler = logging.StreamHandler(stream)
         shandler.setLevel(filelevel)
-        shandler.setFormatter(logging.Formatter(fileformat, filetimeformat))
+        shandler.setFormatter(logging.Formatter(LOGFORMAT, filetimeformat))
         logger.addHandler(shandler)
     # set logger's level to be min of both handlers'
     logger.setLevel(min(level, filelevel))
     return logger
 
+# XSLT to remove namespaces, from https://stackoverflow.com/questions/4255277
+_STRIP_NS_XSLT = b"""
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="xml" indent="no"/>
+
+        <xsl:template match="/|comment()|processing-instruction()">
+            <xsl:copy>
+              <xsl:apply-templates/>
+            </xsl:copy>
+        </xsl:template>
+
+        <xsl:template match="*">
+            <xsl:element name="{local-name()}">
+              <xsl:apply-templates select="@*|node()"/>
+            </xsl:element>
+        </xsl:template>
+
+        <xsl:template match="@*">
+            <xsl:attribute name="{local-name()}">
+              <xsl:value-of select="."/>
+            </xsl:attribute>
+        </xsl:template>
+    </xsl:stylesheet>
+"""
+_strip_ns_transform = None
+
+def _get_strip_ns_transform():
+    """Return the compiled XSLT transform to remove namespaces. It is compiled
+    on first use only, such that lxml is not imported until needed
+    """
+    global _strip_ns_transform
+    if _strip_ns_transform is None:
+        from lxml import etree
+        _strip_ns_transform = etree.XSLT(etree.parse(io.BytesIO(_STRIP_NS_XSLT)))
+    return _strip_ns_transform
+
 def readxml(filename, retain_namespace=False):
     """Read XML from a file and optionally remove the namespace (default)
 
@@ -215,35 +260,12 @@ def readxml(filename, retain_namespace=False):
     from lxml import etree
     dom = etree.parse(os.path.expanduser(filename))
     if not retain_namespace:
-        # XSLT from https://stackoverflow.com/questions/4255277
-        xslt = """
-            <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-                <xsl:output method="xml" indent="no"/>
-
-                <xsl:template match="/|comment()|processing-instruction()">
-                    <xsl:copy>
-                      <xsl:apply-templates/>
-                    </xsl:copy>
-                </xsl:template>
-
-                <xsl:template match="*">
-                    <xsl:element name="{local-name()}">
-                      <xsl:apply-templates select="@*|node()"/>
-                    </xsl:element>
-                </xsl:template>
-
-                <xsl:template match="@*">
-                    <xsl:attribute name="{local-name()}">
-                      <xsl:value-of select="."/>
-                    </xsl:attribute>
-                </xsl:template>
-            </xsl:stylesheet>
-        """
-        xslt_doc = etree.parse(io.BytesIO(bytes(xslt, "utf-8")))
-        transform = etree.XSLT(xslt_doc)
-        dom = transform(dom)
+        dom = _get_strip_ns_transform()(dom)
     return dom
 
+# key=val line: key is up to the first "=", val is up to end of line or "#" for comments
+_KEYVAL_RE = re.compile(r"^([^#=\n]*)=([^#\n]*)", re.MULTILINE)
+
 def readkeyval(filename):
     """Load a text file of key=val lines and return a dictionary. Comments can
     be started with # char and run up to the end of line. Supposed to be used as
@@ -254,18 +276,9 @@ def readkeyval(filename):
     Returns:
         Dictionary of the corresponding key=val context
     """
-    COMMENT_CHAR, OPTION_CHAR = '#', '='
-    options = {}
     with open(os.path.expanduser(filename), 'r') as fp:
-        for line in fp:
-            # remove comments from a line
-            if COMMENT_CHAR in line:
-                line, _ = line.split(COMMENT_CHAR, 1)
-            # parse key=value
-            if OPTION_CHAR in line:
-                option, value = line.split(OPTION_CHAR, 1)
-                options[option.strip()] = value.strip()
-    return options
+        text = fp.read()
+    return {option.strip(): value.strip() for option, value in _KEYVAL_RE.findall(text)}
 
 def readyaml(filename):
     """Load a YAML file and return a dictionary. Supposed to be used as a config
@@ -281,7 +294,12 @@ def readyaml(filename):
         IOError if cannot read filename, AssertionError if the YAML read is not a dictionary
     """
     import yaml
-    data = yaml.load(open(os.path.expanduser(filename)))
+    try:
+        from yaml import CSafeLoader as Loader # libyaml binding
+    except ImportError:
+        from yaml import SafeLoader as Loader
+    with open(os.path.expanduser(filename)) as fp:
+        data = yaml.load(fp, Loader=Loader)
     assert isinstance(data, dict)
     return data
 
@@ -341,9 +359,24 @@ def email(sender, recipient, subject, body, smtphost, smtpport=25,
         from email.policy import SMTP
         return msg.as_bytes(policy=SMTP)
 
+_session = None
+
+def _get_session():
+    """Return the requests session shared by curl() calls, created on first use.
+    Cookies are rejected by the session such that requests remain stateless
+    while connections are kept alive and reused
+    """
+    global _session
+    if _session is None:
+        import http.cookiejar
+        import requests
+        _session = requests.Session()
+        _session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return _session
+
 def curl(url, data=None, method='get'):
     """Download one file from a web URL. The request is stateless, just like
-    what the cURL tool would do.
+    what the cURL tool would do, but connections to the same host are reused.
 
     Args:
         url (str): URL to request
@@ -354,9 +387,8 @@ def curl(url, data=None, method='get'):
         requests.response object. We can get the content in binary or text using
         response.content or response.text respectively
     """
-    import requests
     assert method in ["get", "put", "post", "delete", "head", "options"]
-    requestfunction = getattr(requests, method)
+    requestfunction = getattr(_get_session(), method)
     params = {}
     if data:
         params["data"] = data
@@ -378,13 +410,15 @@ def sieve(iterable, indicator):
     """
     positive = []
     negative = []
+    appenders = (negative.append, positive.append) # indexed by bool
     for item in iterable:
-        (positive if indicator(item) else negative).append(item)
+        appenders[bool(indicator(item))](item)
     return positive, negative
 
-def flatten(sequence, types=None, checker=lambda x:hasattr(x,'__iter__')):
+def flatten(sequence, types=None,
+            checker=lambda x:hasattr(x,'__iter__') and not isinstance(x, str)):
     """Flatten a sequence. By default, a sequence will be flattened until no element has __iter__
-    attribute.
+    attribute. Strings are not flattened by default as each character is a string itself.
 
     Args:
         types: a data type or a tuple of data types. If provided, only elements of these types will
@@ -393,16 +427,40 @@ def flatten(sequence, types=None, checker=lambda x:hasattr(x,'__iter__')):
                  be flattened
 
     Returns:
-        This is a generator that recursively yields all elements in the input sequence
+        This is a generator that yields all elements in the input sequence depth-first. Nested
+        sequences are descended with an explicit stack of iterators instead of recursion. Strings
+        of zero or one character are never descended as they iterate over themselves, and
+        RecursionError is raised if the nesting is deeper than the recursion limit
     """
-    for x in sequence:
-        if (types and isinstance(x, types)) or (not types and checker(x)):
-            for z in flatten(x):
-                yield z
-        else:
+    descend = (lambda x: isinstance(x, types)) if types else checker
+    maxdepth = sys.getrecursionlimit()
+    stack = [iter(sequence)]
+    while stack:
+        for x in stack[-1]:
+            if descend(x) and not (isinstance(x, str) and len(x) <= 1):
+                if len(stack) >= maxdepth:
+                    raise RecursionError("flatten() nested deeper than {}".format(maxdepth))
+                stack.append(iter(x))
+                break # continue with the nested sequence
             yield x
+        else:
+            stack.pop() # exhausted
+
+def subdict(_dict, _keys):
+    """Strip down an input dict to keep only some specified keys
 
-# strip down an input dict to keep only some specified keys
-subdict = lambda _dict, _keys: {k:v for k,v in _dict.items() if k in _keys}
+    Args:
+        _dict: the input dict
+        _keys: an iterable of keys to keep, keys not in the input dict are ignored
+
+    Returns:
+        A new dict. It is produced by iterating over the smaller of the input dict and the keys,
+        hence the order of items follows whichever is smaller
+    """
+    if not isinstance(_keys, (set, frozenset, dict)):
+        _keys = dict.fromkeys(_keys) # hashed lookup, preserving order
+    if len(_keys) < len(_dict):
+        return {k:_dict[k] for k in _keys if k in _dict}
+    return {k:v for k,v in _dict.items() if k in _keys}
 
 # vim:set ts=4 sw=4 sts=4 tw=100 fdm=indent et:
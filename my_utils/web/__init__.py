@@ -2,6 +2,6 @@
 
 """headless browser functions"""
 
-from .browser import browser
+from .browser import browser, BrowserPool
 
 # vim:set ts=4 sw=4 sts=4 tw=100 fdm=indent et:
@@ -4,21 +4,58 @@
 """
 
 import os
+import queue
 import signal
+import threading
 
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support.expected_conditions import staleness_of, title_contains
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 
-__all__ = ['browser']
+__all__ = ['browser', 'BrowserPool']
 
 __FILEDIR = os.path.dirname(os.path.realpath(__file__))
+_SCRIPTS = {}
+_READY_JS = "return document.readyState === 'complete'"
+# asynchronous script that returns true when the load event fires, or immediately if it already
+# did, or false after arguments[0] milliseconds
+_LOADED_JS = ("var done = arguments[arguments.length - 1];"
+              "if (document.readyState === 'complete') done(true);"
+              "else {"
+              " var timer = setTimeout(() => done(false), arguments[0]);"
+              " window.addEventListener('load', () => { clearTimeout(timer); done(true); }, {once: true});"
+              "}")
+# attributes of one element, or each of an array of elements, as name-value objects
+_ATTRS_JS = "return Object.fromEntries(Array.from(arguments[0].attributes, a => [a.name, a.value]));"
+_ATTRS_BATCH_JS = ("return arguments[0].map("
+                   "e => Object.fromEntries(Array.from(e.attributes, a => [a.name, a.value])));")
+
+def _load_script(name):
+    """Return the content of a JavaScript file in this directory. Files are read
+    only once and then kept in memory"""
+    try:
+        return _SCRIPTS[name]
+    except KeyError:
+        with open(os.path.join(__FILEDIR, name)) as fp:
+            js = _SCRIPTS[name] = fp.read()
+        return js
+
+def _save_text(filename, text, chunksize=1<<20):
+    """Write a string to a file in UTF-8. The string is written in slices of
+    chunksize characters such that at most one slice is held in encoded form"""
+    with open(filename, 'w', encoding='utf8', newline='') as fp:
+        for i in range(0, len(text), chunksize):
+            fp.write(text[i:i+chunksize])
 
 class browser:
     """browser object: Wrapper for selenium"""
-    def __init__(self, width=1200, height=800, driver="chrome", headless=True, **kwargs):
-        """create and initialize selenium"""
+    def __init__(self, width=1200, height=800, driver="chrome", headless=True, script_timeout=30,
+                 pool_size=16, **kwargs):
+        """create and initialize selenium. script_timeout is the number of seconds to wait for
+        asynchronous scripts, such as the image download in capture_image(). pool_size is the
+        number of HTTP connections kept to the driver, for issuing commands from multiple threads"""
         if driver == "chrome":
             try:
                 options = kwargs['chrome_options']
@@ -54,10 +91,15 @@ class browser:
             self._driver = webdriver.Firefox(firefox_options=options)
         else:
             raise NotImplementedError("Unrecognized driver %s" % driver)
-
-    def __del__(self):
-        """close selenium browser at object destruct"""
-        self.quit()
+        self._script_timeout = script_timeout
+        self._driver.set_script_timeout(script_timeout)
+        self._driver.implicitly_wait(0)  # no implicit wait: use WebDriverWait for specific elements
+        # urllib3 keeps only one connection per host by default, which serializes concurrent
+        # commands and warns "connection pool is full"
+        conn = getattr(self._driver.command_executor, '_conn', None)
+        if pool_size and hasattr(conn, 'connection_pool_kw'):
+            conn.connection_pool_kw['maxsize'] = pool_size
+            conn.clear()  # pools are recreated with the new size on next command
 
     def __enter__(self):
         "for context manager"
@@ -67,33 +109,46 @@ class browser:
         print("Closing browser")
         self.quit()
 
-    def quit(self):
-        """close this browser and render it not functional"""
+    @classmethod
+    def pool(cls, size, max_uses=None, **kwargs):
+        """Create a BrowserPool of `size` browsers. Other arguments are passed on
+        to BrowserPool"""
+        return BrowserPool(size, max_uses=max_uses, **kwargs)
+
+    def quit(self, force=False):
+        """close this browser and render it not functional. Set force to True to
+        also send SIGTERM to the driver process, for when it is not responding"""
         if self._driver:
-            self._driver.service.process.send_signal(signal.SIGTERM) # kill child proc
-            #self._driver.close()
-            self._driver.quit()
-            self._driver = None
+            try:
+                if force:
+                    self._driver.service.process.send_signal(signal.SIGTERM) # kill child proc
+                self._driver.quit()
+            finally:
+                # forget methods of the driver cached by __getattr__
+                for name, attr in list(self.__dict__.items()):
+                    if getattr(attr, '__self__', None) is self._driver:
+                        del self.__dict__[name]
+                self._driver = None
 
     def user_agent(self):
         """return the browser user-agent string"""
         return self._driver.execute_script("return navigator.userAgent")
 
     def cookies(self):
-        """return all cookies as a python dict"""
-        biscus = self._driver.manage().cookies()
-        if not biscus:
-            # IE and FF, cannot read cookies like above
-            cookiestring = self._driver.execute_script("return document.cookie")
-            biscus = {}
-            for cookie in cookiestring.split("; "):
-                key, val = cookie.split("=", 1)
-                biscus[key] = val
-        return biscus
+        """return all cookies visible to the current page as a python dict, including HttpOnly ones"""
+        return {cookie['name']: cookie['value'] for cookie in self._driver.get_cookies()}
 
     def __getattr__(self, name):
-        """pass through all unrecognized webdriver functions and attributes"""
-        return getattr(self._driver, name)
+        """pass through all unrecognized webdriver functions and attributes. Bound
+        methods are cached in the instance such that subsequent lookups do not
+        come here again. Other attributes, such as properties, are not cached as
+        their values may change"""
+        if name == '_driver':
+            raise AttributeError(name)  # not initialized
+        attr = getattr(self._driver, name)
+        if callable(attr) and getattr(attr, '__self__', None) is self._driver:
+            self.__dict__[name] = attr
+        return attr
 
     def wait_until_staled(self, element, timeout=30):
         WebDriverWait(self._driver, timeout).until(staleness_of(element))
@@ -103,7 +158,25 @@ class browser:
         calling the boolean function once every 500ms until True is returned. See
         https://selenium-python.readthedocs.io/waits.html
         """
-        WebDriverWait(self._driver, timeout).until(lambda doc: doc.is_ready())
+        WebDriverWait(self._driver, timeout).until(lambda driver: driver.execute_script(_READY_JS))
+
+    def wait_loaded(self, timeout=30):
+        """Wait until the page load event fired, for at most timeout seconds. Unlike
+        wait_until_ready(), which polls, the browser notifies the completion in a
+        single asynchronous script round-trip. The deadline is kept in the script
+        such that the script timeout of the driver, shared by other threads, is not
+        changed. Hence the wait is shortened to end before the script_timeout of the
+        constructor
+
+        Returns:
+            True if the page is loaded, False if timed out
+        """
+        # one second, or half of a short script timeout, for the script to return in time
+        timeout = min(timeout, max(self._script_timeout - 1, self._script_timeout / 2))
+        try:
+            return self._driver.execute_async_script(_LOADED_JS, int(timeout * 1000))
+        except TimeoutException:
+            return False  # the driver timed out before the script did
 
     # TODO more robust waiting functions
     #   - this may work: self._driver.manage().timeouts().pageLoadTimeout(10, TimeUnit.SECONDS)
@@ -111,7 +184,7 @@ class browser:
 
     def is_ready(self):
         """Return True iff the page is loaded"""
-        return self._driver.execute_script("return document.readyState === 'complete'")
+        return self._driver.execute_script(_READY_JS)
 
     def get_everything(self):
         """Extract everything from the DOM
@@ -120,51 +193,159 @@ class browser:
             ['element','xpath','visible','x','y','w','h','fg','bg','font','attrs','text','html']
             which element is the DOM object and other are string or numbers
         """
-        scriptpath = os.path.join(__FILEDIR, 'get_everything.js')
-        js = open(scriptpath).read()
+        js = _load_script('get_everything.js')
         ret = self._driver.execute_script(js)
         return ret
 
     def get_xpath(self, element):
-        scriptpath = os.path.join(__FILEDIR, 'get_xpath.js')
-        js = open(scriptpath).read()
+        js = _load_script('get_xpath.js')
         ret = self._driver.execute_script(js, element)
         return ret
 
+    def get_xpaths(self, elements):
+        """Batch version of get_xpath(): return the list of xpaths of a list of
+        elements in one round-trip to the browser"""
+        js = _load_script('get_xpath.js')
+        ret = self._driver.execute_script(js, list(elements))
+        return ret
+
     def get_all_attrs(self, element):
-        js = '''
-            var items = {};
-            for (index = 0; index < arguments[0].attributes.length; ++index) {
-                items[arguments[0].attributes[index].name] = arguments[0].attributes[index].value
-            };
-            return items;
-        '''
-        ret = self._driver.execute_script(js, element)
+        ret = self._driver.execute_script(_ATTRS_JS, element)
+        return ret
+
+    def get_all_attrs_batch(self, elements):
+        """Batch version of get_all_attrs(): return the list of attribute dicts
+        of a list of elements in one round-trip to the browser"""
+        ret = self._driver.execute_script(_ATTRS_BATCH_JS, list(elements))
         return ret
 
     def save_page_source(self, filename):
-        open(filename, 'wb').write(self._driver.page_source.encode('utf8'))
+        _save_text(filename, self._driver.page_source)
 
     def save_rendered_html(self, filename):
         html = self._driver.execute_script('return document.documentElement.outerHTML;')
-        open(filename, 'wb').write(html.encode('utf8'))
+        _save_text(filename, html)
 
     def capture_image(self, url):
         """re-fetch the URL image and convert it into base64 encoded binary,
-        then save into a span element under document
+        in one asynchronous script round-trip
 
         Capture by XHR, code derived from
         https://crosp.net/blog/software-development/web/download-images-using-webdriverio-selenium-webdriver/
 
         See also https://stackoverflow.com/questions/934012/get-image-data-in-javascript for promise syntax
+
+        Returns:
+            the image as base64 data URL string, or None if failed to download the image
         """
-        scriptpath = os.path.join(__FILEDIR, 'download_img.js')
-        js = open(scriptpath).read()
-        self._driver.execute_script(js, url)
-        element = self._driver.find_element_by_id("base64imagedownload")  # expect implicit wait
-        if element:
-            return self._driver.execute_script("return document.getElementById('base64download').textContent")
-        return None  # failed to download the image
+        js = _load_script('download_img.js')
+        return self._driver.execute_async_script(js, url)
+
+# queued in a BrowserPool in place of a browser to wake up acquire() when no browser will come
+_NO_BROWSER = object()
+
+class BrowserPool:
+    """Pool of browser objects launched in advance, to amortize the browser
+    start up time over many short tasks. Browsers are taken out by acquire() and
+    handed back by release(), which resets the browser for the next user"""
+    def __init__(self, size, max_uses=None, **kwargs):
+        """Launch `size` browsers with the keyword arguments passed on to the
+        browser constructor. If max_uses is given, a browser is replaced by a
+        newly launched one after it has been released for that many times"""
+        self._kwargs = kwargs
+        self._max_uses = max_uses
+        self._uses = {}  # every browser launched and not yet quit -> number of times released
+        self._lock = threading.Lock()
+        self._closed = False
+        self._size = 0  # number of browsers in the pool, acquired or not
+        self._queue = queue.Queue()
+        try:
+            for _ in range(size):
+                b = browser(**kwargs)
+                self._uses[b] = 0
+                self._size += 1
+                self._queue.put(b)
+        except BaseException:
+            self.close()  # do not leave the browsers launched so far running
+            raise
+
+    def __enter__(self):
+        "for context manager"
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        "Close all browsers in the pool"
+        self.close()
+
+    def acquire(self, timeout=None):
+        """Take a browser from the pool, block for at most `timeout` seconds (or
+        forever if None) until one is available. Raises queue.Empty on timeout,
+        or RuntimeError if the pool is closed or has no browser left"""
+        b = self._queue.get(timeout=timeout)
+        if b is _NO_BROWSER:
+            self._queue.put(b)  # for other threads waiting
+            raise RuntimeError("BrowserPool is closed" if self._closed
+                               else "BrowserPool has no browser left")
+        return b
+
+    def release(self, b):
+        """Hand back a browser to the pool. Cookies are deleted and the page is
+        reset to blank. Browsers failed to reset or reached max_uses are quit
+        and replaced. Browsers released after the pool is closed are quit. If
+        the replacement failed to launch, the pool is shrunk by one and the
+        exception is raised"""
+        with self._lock:
+            uses = self._uses.get(b, 0) + 1
+            renew = self._closed or (bool(self._max_uses) and uses >= self._max_uses)
+        broken = False
+        if not renew:
+            try:
+                b.delete_all_cookies()
+                b.get("about:blank")
+            except Exception:
+                renew = broken = True
+        if renew:
+            self._quit(b, force=broken)  # kill the driver process only if not responding
+            with self._lock:
+                if self._closed:
+                    return
+            try:
+                b, uses = browser(**self._kwargs), 0
+            except BaseException:
+                with self._lock:
+                    self._size -= 1
+                    if not self._size and not self._closed:
+                        self._queue.put(_NO_BROWSER)
+                raise
+        with self._lock:
+            if not self._closed:
+                self._uses[b] = uses
+                self._queue.put(b)
+                return
+        self._quit(b)  # pool closed while the browser is launched
+
+    def _quit(self, b, force=False):
+        "Quit a browser and forget it, ignoring errors as it may be broken already"
+        with self._lock:
+            self._uses.pop(b, None)
+        try:
+            b.quit(force=force)
+        except Exception:
+            pass
+
+    def close(self):
+        """Quit all browsers launched by the pool, including those acquired and
+        not yet released"""
+        with self._lock:
+            self._closed = True
+            browsers = list(self._uses)
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(_NO_BROWSER)
+        for b in browsers:
+            self._quit(b)
 
 def _example():
     "Example of using webdriver"
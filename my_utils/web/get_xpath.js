@@ -26,4 +26,7 @@ var getXPathTo = function (element){
         return getXPathTo(element.parentNode)+'/'+element.tagName.toLowerCase()+'['+hit+']';
     };
 };
+// Argument is either one element or an array of elements
+if (Array.isArray(arguments[0]))
+    return arguments[0].map(getXPathTo);
 return getXPathTo(arguments[0]);
@@ -25,9 +25,7 @@ package_data = {
         'web/get_xpath.js',
     ]
 }
-requires = [
-    "pipe",
-]
+requires = []
 classifiers = [
     "Development Status :: 3 - Alpha",
     "Programming Language :: Python",